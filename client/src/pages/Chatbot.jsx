@@ -24,6 +24,98 @@ export default function Chatbot() {
   /* Refs for DOM Access */
   const messagesEndRef = useRef(null); // Points to bottom of messages (for auto-scroll)
   const inputRef = useRef(null); // Points to input field (for auto-focus)
+  const socketRef = useRef(null); // Chat WebSocket, authenticated once per connection
+  const turnsRef = useRef({}); // Turn id -> { conversationId, done, notice }, for routing streamed replies
+
+  /* Append to (or replace) the bot reply for a turn */
+  const updateBotMessage = (conversationId, turnId, update) => {
+    setConversations((prev) =>
+      prev.map((conv) => {
+        if (conv.id !== conversationId) return conv;
+        const msgId = `bot-${turnId}`;
+        const existing = conv.messages.find((m) => m.id === msgId);
+        const text = update(existing ? existing.text : "");
+        return {
+          ...conv,
+          messages: existing
+            ? conv.messages.map((m) => (m.id === msgId ? { ...m, text } : m))
+            : [...conv.messages, { id: msgId, sender: "bot", text }],
+        };
+      })
+    );
+  };
+
+  /* WebSocket Effect: stream replies and receive pushed notifications */
+  useEffect(() => {
+    const socket = new WebSocket("ws://localhost:8000/ws/chat");
+    socketRef.current = socket;
+
+    socket.onmessage = (event) => {
+      const frame = JSON.parse(event.data);
+      const turn = turnsRef.current[frame.id];
+      if (turn === undefined) return;
+      const { conversationId } = turn;
+
+      if (frame.type === "notification") {
+        // e.g. a recipe saved in the background after "Log meal"
+        updateBotMessage(conversationId, `${frame.id}-notice`, () => frame.response);
+        if (turn.done) {
+          delete turnsRef.current[frame.id];
+        } else {
+          turn.notice = false; // arrived first; the "done" frame finishes the turn
+        }
+        return;
+      }
+
+      if (frame.type === "token") {
+        setIsTyping(false);
+        updateBotMessage(conversationId, frame.id, (text) => text + frame.text);
+      } else if (frame.type === "reset") {
+        // Draft rejected by the diet guard; a corrected answer follows
+        updateBotMessage(conversationId, frame.id, () => "");
+        setIsTyping(true);
+      } else if (frame.type === "done" || frame.type === "error") {
+        const text =
+          frame.type === "done" ? frame.response : "Error: Could not reach AI service.";
+        updateBotMessage(conversationId, frame.id, () => text);
+        setIsTyping(false);
+        inputRef.current?.focus();
+        // "Log meal" turns wait for their notification
+        if (turn.notice && frame.type === "done") {
+          turn.done = true;
+        } else {
+          delete turnsRef.current[frame.id];
+        }
+      }
+    };
+
+    socket.onerror = () => {
+      console.error("Chat WebSocket error");
+    };
+
+    /* Connection lost: fail anything still in flight; later sends use HTTP */
+    socket.onclose = () => {
+      if (socketRef.current === socket) socketRef.current = null;
+      for (const [turnId, turn] of Object.entries(turnsRef.current)) {
+        if (turn.done) {
+          updateBotMessage(turn.conversationId, `${turnId}-notice`, () =>
+            "Lost connection before the save was confirmed. Please check your log."
+          );
+        } else {
+          updateBotMessage(turn.conversationId, turnId, (text) =>
+            text ? `${text}\n\nError: Connection lost.` : "Error: Connection lost."
+          );
+        }
+      }
+      turnsRef.current = {};
+      setIsTyping(false);
+    };
+
+    return () => {
+      socket.onclose = null; // unmounting, nothing to report
+      socket.close();
+    };
+  }, []);
 
   /* Auto-scroll Effect */
   useEffect(() => {
@@ -56,6 +148,25 @@ export default function Chatbot() {
     setInput("");
     setIsTyping(true);
 
+    // Prefer the open WebSocket; fall back to a plain HTTP request
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      const turnId = Date.now();
+      turnsRef.current[turnId] = {
+        conversationId: activeConversationId,
+        done: false,
+        notice: messageToSend.trim().toLowerCase() === "log meal",
+      };
+      socket.send(
+        JSON.stringify({
+          id: turnId,
+          message: messageToSend.trim(),
+          conversation: activeConversationId,
+        })
+      );
+      return;
+    }
+
     try {
       // Debug: log all cookies
       console.log("document.cookie:", document.cookie);
@@ -77,6 +188,7 @@ export default function Chatbot() {
         credentials: "include", // this sends cookies!
         body: JSON.stringify({
           message: messageToSend.trim(),
+          conversation: activeConversationId,
         }),
       });
 
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+# Initial days of history allocated per user (whole weeks); arrays double when full
+INITIAL_DAYS = 63
+# How long a session -> user mapping is trusted before history is reloaded
+SESSION_TTL = 300
+MAX_SESSIONS = 4096
+
+
+def to_day(value):
+    # Accepts a date or an ISO string ("2025-06-23" or a full timestamp)
+    if isinstance(value, date):
+        return value.toordinal()
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+
+def week_start(day):
+    # Ordinal of the Monday of the week containing `day`
+    return day - date.fromordinal(day).weekday()
+
+
+class UserRollup:
+    # Daily and weekly calorie totals for one user, stored as dense NumPy
+    # arrays indexed from the Monday of the user's first logged week.
+
+    def __init__(self, first_day, calorie_goal=None):
+        self.origin = week_start(first_day)
+        self.daily = np.zeros(INITIAL_DAYS, dtype=np.float64)
+        self.weekly = np.zeros(INITIAL_DAYS // 7, dtype=np.float64)
+        self.calorie_goal = calorie_goal
+
+    def _ensure(self, day):
+        # Grow (or shift, for days before the origin) so `day` has a slot.
+        if day < self.origin:
+            shift_weeks = (self.origin - week_start(day)) // 7
+            shift = shift_weeks * 7
+            self.daily = np.concatenate([np.zeros(shift), self.daily])
+            self.weekly = np.concatenate([np.zeros(shift_weeks), self.weekly])
+            self.origin -= shift
+        needed = day - self.origin + 1
+        if needed > len(self.daily):
+            size = max(needed, len(self.daily) * 2)
+            size += (-size) % 7
+            self.daily = np.concatenate([self.daily, np.zeros(size - len(self.daily))])
+            self.weekly = np.concatenate([self.weekly, np.zeros(size // 7 - len(self.weekly))])
+
+    def add(self, day, calories):
+        # Negative calories undo a deleted log entry
+        self._ensure(day)
+        i = day - self.origin
+        self.daily[i] += calories
+        self.weekly[i // 7] += calories
+
+    def add_many(self, days, calories):
+        days = np.asarray(days, dtype=np.int64)
+        calories = np.asarray(calories, dtype=np.float64)
+        if days.size == 0:
+            return
+        self._ensure(int(days.min()))
+        self._ensure(int(days.max()))
+        idx = days - self.origin
+        np.add.at(self.daily, idx, calories)
+        np.add.at(self.weekly, idx // 7, calories)
+
+    def _slice(self, start, end):
+        # Daily totals for [start, end] inclusive, zero-filled outside history
+        out = np.zeros(end - start + 1, dtype=np.float64)
+        lo = max(start, self.origin)
+        hi = min(end, self.origin + len(self.daily) - 1)
+        if lo <= hi:
+            out[lo - start:hi - start + 1] = self.daily[lo - self.origin:hi - self.origin + 1]
+        return out
+
+    def range(self, start, end):
+        values = self._slice(start, end)
+        logged = values > 0
+        return {
+            "start": date.fromordinal(start).isoformat(),
+            "end": date.fromordinal(end).isoformat(),
+            "daily_calories": values.tolist(),
+            "total_calories": float(values.sum()),
+            "average_calories": float(values[logged].mean()) if logged.any() else 0.0,
+            "days_logged": int(logged.sum()),
+        }
+
+    def week(self, day):
+        # Same shape as past_week_calories in the Express /dashboard response
+        monday = week_start(day)
+        values = self._slice(monday, monday + 6)
+        w = (monday - self.origin) // 7
+        total = float(self.weekly[w]) if 0 <= w < len(self.weekly) else 0.0
+        return {
+            "week_start": date.fromordinal(monday).isoformat(),
+            "past_week_calories": dict(zip(WEEKDAYS, (int(v) for v in values))),
+            "total_calories": total,
+        }
+
+    def weeks(self, start, end):
+        first = (week_start(start) - self.origin) // 7
+        last = (week_start(end) - self.origin) // 7
+        out = np.zeros(last - first + 1, dtype=np.float64)
+        lo, hi = max(first, 0), min(last, len(self.weekly) - 1)
+        if lo <= hi:
+            out[lo - first:hi - first + 1] = self.weekly[lo:hi + 1]
+        return out
+
+    def goal_met(self, values):
+        # A day meets the goal if something was logged and it stays within it
+        if not self.calorie_goal:
+            return values > 0
+        return (values > 0) & (values <= self.calorie_goal)
+
+    def streak(self, day):
+        # Consecutive goal-meeting days ending today, or yesterday if today
+        # has nothing logged yet.
+        if day < self.origin:
+            return 0
+        values = self._slice(self.origin, day)
+        met = self.goal_met(values)
+        end = len(values) - 1
+        if values[end] == 0 and end > 0:
+            end -= 1
+        misses = np.flatnonzero(~met[:end + 1])
+        return int(end - misses[-1]) if misses.size else end + 1
+
+    def goal_percentage(self, start, end):
+        values = self._slice(start, end)
+        if not self.calorie_goal:
+            percentages = np.zeros_like(values)
+        else:
+            percentages = np.round(values / self.calorie_goal * 100, 1)
+        return {
+            "calorie_goal": self.calorie_goal,
+            "daily_percentage": percentages.tolist(),
+            "days_goal_met": int(self.goal_met(values).sum()),
+            "days": len(values),
+        }
+
+
+class AnalyticsStore:
+    # In-memory rollups for every user, updated as meals are logged. A user's
+    # rollup only exists once it has been loaded from full history; changes for
+    # users not loaded yet are dropped and picked up by that load instead.
+    # Every change bumps the user's version, so a load that raced with one can
+    # be detected and retried.
+
+    def __init__(self):
+        self.users = {}
+        self.versions = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def version(self, userid):
+        return self.versions.get(userid, 0)
+
+    def record_meal(self, userid, day, calories, calorie_goal=None):
+        with self.lock:
+            self.versions[userid] = self.versions.get(userid, 0) + 1
+            rollup = self.users.get(userid)
+            if rollup is None:
+                return False
+            rollup.add(day, calories)
+            if calorie_goal:
+                rollup.calorie_goal = calorie_goal
+            return True
+
+    def backfill(self, userid, days, calories, calorie_goal=None, version=None):
+        # Replace a user's rollup from full history, e.g. after a restart. With
+        # `version` (read before the history was fetched), nothing is replaced
+        # and False is returned if a meal change arrived in the meantime.
+        first = int(min(days)) if len(days) else date.today().toordinal()
+        rollup = UserRollup(first, calorie_goal)
+        rollup.add_many(days, calories)
+        with self.lock:
+            if version is not None and self.versions.get(userid, 0) != version:
+                return False
+            self.users[userid] = rollup
+        return True
+
+    def forget(self, userid):
+        with self.lock:
+            self.users.pop(userid, None)
+
+    def set_goal(self, userid, calorie_goal):
+        with self.lock:
+            rollup = self.users.get(userid)
+            if rollup is not None and calorie_goal:
+                rollup.calorie_goal = calorie_goal
+
+    def get(self, userid):
+        return self.users.get(userid)
+
+    def user_for_session(self, sessionid):
+        entry = self.sessions.get(sessionid)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def remember_session(self, sessionid, userid):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.sessions) >= MAX_SESSIONS:
+                self.sessions = {k: v for k, v in self.sessions.items() if v[1] >= now}
+            self.sessions[sessionid] = (userid, now + SESSION_TTL)
+
+
+analytics_store = AnalyticsStore()
+
+
+def default_range(start, end, days=7, max_days=None):
+    # Raises ValueError for malformed dates, reversed or over-long ranges
+    end_day = to_day(end) if end else date.today().toordinal()
+    start_day = to_day(start) if start else end_day - days + 1
+    if start_day > end_day:
+        raise ValueError("start must not be after end")
+    if max_days and end_day - start_day + 1 > max_days:
+        raise ValueError(f"Range must not exceed {max_days} days")
+    return start_day, end_day
+
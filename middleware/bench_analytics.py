@@ -0,0 +1,100 @@
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import date
+
+from analytics import AnalyticsStore, week_start
+
+# Benchmark: weekly chart, streak and goal-percentage queries over users with
+# years of synthetic meal history, comparing the incremental NumPy rollups with
+# re-aggregating raw consumed_meals rows on every dashboard load.
+
+
+def synthetic_history(years, seed):
+    rng = random.Random(seed)
+    today = date.today().toordinal()
+    rows = []
+    for day in range(today - years * 365, today + 1):
+        if rng.random() < 0.15:
+            continue  # day with nothing logged
+        for _ in range(rng.randint(1, 4)):
+            rows.append((day, rng.randint(150, 900)))
+    return rows
+
+
+def naive_dashboard(rows, today, goal):
+    # What the dashboard does today: group every raw row by date on each load
+    per_day = defaultdict(float)
+    for day, calories in rows:
+        per_day[day] += calories
+    monday = week_start(today)
+    week = [per_day.get(monday + i, 0.0) for i in range(7)]
+
+    streak = 0
+    day = today if per_day.get(today) else today - 1
+    while 0 < per_day.get(day, 0) <= goal:
+        streak += 1
+        day -= 1
+
+    month = [per_day.get(today - i, 0.0) for i in range(30)]
+    met = sum(1 for v in month if 0 < v <= goal)
+    return week, streak, met
+
+
+def rollup_dashboard(rollup, today):
+    week = rollup.week(today)
+    streak = rollup.streak(today)
+    goal = rollup.goal_percentage(today - 29, today)
+    return week, streak, goal["days_goal_met"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--loads", type=int, default=5, help="dashboard loads per user")
+    args = parser.parse_args()
+
+    goal = 2000
+    today = date.today().toordinal()
+    histories = {u: synthetic_history(args.years, u) for u in range(args.users)}
+    total_rows = sum(len(r) for r in histories.values())
+    print(f"{args.users} users, {args.years} years, {total_rows} meal rows")
+
+    store = AnalyticsStore()
+    started = time.perf_counter()
+    for userid, rows in histories.items():
+        store.backfill(userid, [], [], goal)
+        for day, calories in rows:
+            store.record_meal(userid, day, calories, goal)
+    ingest = time.perf_counter() - started
+    print(f"incremental ingest: {ingest / total_rows * 1e6:.2f} us/meal")
+
+    started = time.perf_counter()
+    for userid, rows in histories.items():
+        store.backfill(userid, [d for d, _ in rows], [c for _, c in rows], goal)
+    print(f"vectorised backfill: {(time.perf_counter() - started) / args.users * 1e3:.2f} ms/user")
+
+    started = time.perf_counter()
+    for _ in range(args.loads):
+        for userid, rows in histories.items():
+            expected = naive_dashboard(rows, today, goal)
+    naive = (time.perf_counter() - started) / (args.loads * args.users)
+
+    started = time.perf_counter()
+    for _ in range(args.loads):
+        for userid in histories:
+            result = rollup_dashboard(store.get(userid), today)
+    rollup = (time.perf_counter() - started) / (args.loads * args.users)
+
+    # Sanity check the last user against the naive answer
+    assert list(result[0]["past_week_calories"].values()) == [int(v) for v in expected[0]]
+    assert result[1:] == expected[1:], (result[1:], expected[1:])
+
+    print(f"raw rows per load:  {naive * 1e3:.3f} ms")
+    print(f"rollups per load:   {rollup * 1e3:.3f} ms ({naive / rollup:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+from bench_transport import import_lang
+from fault_stubs import StubExpress
+from log_config import setup_logging, shutdown_logging
+
+# Benchmark: logging cost on the request thread per /chat request, for the
+# stock synchronous DEBUG logging and the queued production mode. The log
+# calls made by real /chat requests (against local stubs) are captured once
+# and then replayed through each configuration.
+
+MODES = {
+    "debug": ("debug", {}),
+    "production": ("production", {}),
+    # Production without sampling or rate limits: queueing and lazy formatting only
+    "production (unsampled)": ("production", {
+        "LOG_SAMPLE_RATES": "DEBUG=1,INFO=1",
+        "LOG_RATE_LIMITS": "DEBUG=1e9,INFO=1e9,WARNING=1e9,ERROR=1e9",
+    }),
+}
+
+
+class CaptureHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def capture_chat_logs(lang):
+    # One recipe request followed by "Log meal", as the endpoint handles them
+    capture = CaptureHandler()
+    root = logging.getLogger()
+    root.addHandler(capture)
+    try:
+        for message in ("Suggest a recipe", "log meal"):
+            asyncio.run(lang.chat(lang.ChatRequest(message=message), sessionid="bench"))
+    finally:
+        root.removeHandler(capture)
+    # Only our own loggers; third-party DEBUG chatter is not part of the request path
+    # LogRecord unwraps a lone dict argument; wrap it back for makeRecord
+    return [
+        (r.name, r.levelno, r.msg, (r.args,) if isinstance(r.args, dict) else r.args or ())
+        for r in capture.records
+        if r.name in ("lang", "diet_guard", "resilience", "meal_suggestions")
+    ]
+
+
+def replay(calls, requests, idle):
+    # Goes through Logger.log, so level checks, the production gate, findCaller
+    # and record creation are all counted. Only time inside log calls is
+    # counted; `idle` stands in for the time a request spends waiting on
+    # Gemini and Express, when the writer can drain.
+    loggers = {name: logging.getLogger(name) for name, *_ in calls}
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        for name, level, msg, args in calls:
+            loggers[name].log(level, msg, *args)
+        samples.append(time.perf_counter() - started)
+        time.sleep(idle)
+    return statistics.median(samples), statistics.fmean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--idle-ms", type=float, default=2.0, help="upstream wait per request")
+    args = parser.parse_args()
+
+    backend = StubExpress()
+    lang = import_lang(backend.base_url)
+    calls = capture_chat_logs(lang)
+    backend.close()
+    print(f"{len(calls)} log calls per /chat request pair")
+
+    with open(os.devnull, "w") as devnull:
+        for label, (mode, env) in MODES.items():
+            os.environ.update(env)
+            setup_logging(f"bench-{mode}.log", mode=mode, stream=devnull)
+            replay(calls, 20, 0)  # warm up
+            median, mean = replay(calls, args.requests, args.idle_ms / 1000)
+            drain = time.perf_counter()
+            shutdown_logging()
+            drain = time.perf_counter() - drain
+            for key in env:
+                os.environ.pop(key)
+            extra = f", background drain {drain * 1000:.0f}ms total" if mode == "production" else ""
+            print(f"{label:>24}: {median * 1e6:7.1f} us median, {mean * 1e6:7.1f} us mean per request on the request thread{extra}")
+
+
+if __name__ == "__main__":
+    main()
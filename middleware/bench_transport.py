@@ -0,0 +1,125 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+# Benchmark: chat messages per second per server core over HTTP POST /chat
+# versus the /ws/chat WebSocket. Gemini and Express are replaced by local
+# stubs so only the transport and per-turn middleware work is measured.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORT = 8765
+ANSWER = (
+    "Recipe: Chickpea Salad\nIngredients:\n- chickpeas\n- cucumber\n- lemon\n"
+    "Instructions: Mix everything.\nCalories per serving: 350"
+)
+
+
+def stub_gemini():
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+
+    class StubGemini(GenericFakeChatModel):
+        # Streams one chunk per line; Gemini sends a few large chunks, not one per word
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            for line in ANSWER.splitlines(keepends=True):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=line))
+
+    return StubGemini(messages=itertools.cycle([AIMessage(content=ANSWER)]))
+
+
+def import_lang(backend_url):
+    # Import the middleware app in a scratch directory, pointed at stubs
+    sys.path.insert(0, HERE)
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    os.environ["BACKEND_URL"] = backend_url
+
+    import lang
+
+    lang.llm = stub_gemini()
+    return lang
+
+
+def serve(backend_url, ready):
+    import uvicorn
+
+    lang = import_lang(backend_url)
+    # Keep the stock DEBUG file logging, but skip flooding the terminal
+    logging.getLogger().handlers = [h for h in logging.getLogger().handlers if isinstance(h, logging.FileHandler)]
+    ready.set()
+    uvicorn.run(lang.app, host="127.0.0.1", port=PORT, log_level="warning")
+
+
+def cpu_seconds(pid):
+    # utime + stime of the server process (Linux)
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def bench_http(n):
+    import httpx
+
+    with httpx.Client(base_url=f"http://127.0.0.1:{PORT}", cookies={"sessionid": "bench-http"}) as client:
+        for i in range(n):
+            response = client.post("/chat", json={"message": f"Suggest recipe {i}"})
+            response.raise_for_status()
+
+
+def bench_ws(n):
+    from websockets.sync.client import connect
+
+    headers = {"Cookie": "sessionid=bench-ws", "Origin": "http://localhost:5173"}
+    with connect(f"ws://127.0.0.1:{PORT}/ws/chat", additional_headers=headers) as ws:
+        for i in range(n):
+            ws.send(json.dumps({"id": i, "message": f"Suggest recipe {i}"}))
+            while True:
+                frame = json.loads(ws.recv())
+                if frame.get("type") == "done":
+                    break
+                if frame.get("type") == "error":
+                    raise RuntimeError(frame["detail"])
+
+
+def measure(name, fn, n, pid):
+    fn(10)  # warm up
+    cpu = cpu_seconds(pid)
+    started = time.perf_counter()
+    fn(n)
+    wall = time.perf_counter() - started
+    cpu = cpu_seconds(pid) - cpu
+    print(f"{name:>9}: {n / wall:8.1f} msg/s wall, {n / cpu:8.1f} msg/s per server core")
+    return n / cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    from fault_stubs import StubExpress
+
+    backend = StubExpress()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(backend.base_url, ready), daemon=True)
+    server.start()
+    ready.wait()
+    time.sleep(1.0)
+    try:
+        http_rate = measure("HTTP", bench_http, args.messages, server.pid)
+        ws_rate = measure("WebSocket", bench_ws, args.messages, server.pid)
+        print(f"WebSocket handles {ws_rate / http_rate:.1f}x the messages per core")
+    finally:
+        server.terminate()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,10 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import json
 import requests
+from log_config import setup_logging
 
-# Setup logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    handlers=[logging.FileHandler("chatbot.log"), logging.StreamHandler()]
-)
+# Setup logging (LOG_MODE=production for queued, sampled JSON logs)
+setup_logging("chatbot.log")
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -39,9 +37,9 @@ def save_recent_prompt_to_db(user_input, assistant_response, sessionid):
     try:
         response = requests.post(url, json=data, headers=headers)
         if response.status_code != 201:
-            logger.error(f"Failed to save recent prompt to DB: {response.text}")
+            logger.error("Failed to save recent prompt to DB: %s", response.text)
     except Exception as e:
-        logger.error(f"Error saving recent prompt to DB: {e}")
+        logger.error("Error saving recent prompt to DB: %s", e)
 
 #Sending recipe  to server. (Post request /user-recipes)
 def save_recipe_to_db(json_string, sessionid):
@@ -60,9 +58,9 @@ def save_recipe_to_db(json_string, sessionid):
         }
         response = requests.post(url, json=data, headers=headers)
         if response.status_code != 201:
-            logger.error(f"Failed to save recipe to DB: {response.text}")
+            logger.error("Failed to save recipe to DB: %s", response.text)
     except Exception as e:
-        logger.error(f"Error saving recipe to DB: {e}")
+        logger.error("Error saving recipe to DB: %s", e)
 ## END OF ROUTING FUNCTIONS ##
 
 ## START OF CHATBOT FUNCTIONS ##
@@ -85,7 +83,7 @@ def load_messagesample():
         logger.debug("No valid messagesample.json found, using default context")
         return None
     except Exception as e:
-        logger.error(f"Error loading messagesample.json: {e}")
+        logger.error("Error loading messagesample.json: %s", e)
         return None
 
 def load_chat_history():
@@ -100,7 +98,7 @@ def load_chat_history():
         logger.debug("No valid recent_prompt.json found, starting with empty history")
         return []
     except Exception as e:
-        logger.error(f"Error loading chat history from JSON: {e}")
+        logger.error("Error loading chat history from JSON: %s", e)
         return []
 
 def save_chat_history(chatbot_history, filename:str):
@@ -110,7 +108,7 @@ def save_chat_history(chatbot_history, filename:str):
             json.dump(chatbot_history, f, indent=4, ensure_ascii=False)
         logger.debug("Chat history saved to chat_history.json")
     except Exception as e:
-        logger.error(f"Error saving chat history to JSON: {e}")
+        logger.error("Error saving chat history to JSON: %s", e)
 
 def format_context(messagesample_data):
     #Format user context from messagesample.json as a system prompt.
@@ -213,7 +211,7 @@ def save_latest_response():
 
         return json_string
     except Exception as e:
-        logger.error(f"Error in save_latest_response: {e}")
+        logger.error("Error in save_latest_response: %s", e)
         return json.dumps({"error": str(e)}, indent=2)
     
 
@@ -256,7 +254,7 @@ def handle_user_query(user_input, chatbot_history):
         
         return "", chatbot_history
     except Exception as e:
-        logger.error(f"Error processing query: {e}")
+        logger.error("Error processing query: %s", e)
         chatbot_history.append({"role": "assistant", "content": f"Error: {str(e)}"})
         save_chat_history(chatbot_history)
         return "", chatbot_history
@@ -0,0 +1,490 @@
+import logging
+import re
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Ingredient synonym index: food group -> surface forms that appear in recipes.
+# Plurals ending in "s"/"es" are matched automatically.
+INGREDIENT_SYNONYMS = {
+    "peanuts": ["peanut", "groundnut", "peanut butter", "peanut oil", "monkey nut"],
+    "tree nuts": [
+        "almond", "cashew", "walnut", "pecan", "hazelnut", "pistachio", "macadamia",
+        "brazil nut", "pine nut", "chestnut", "praline", "marzipan", "nutella",
+    ],
+    "shellfish": [
+        "shrimp", "prawn", "crab", "lobster", "crayfish", "langoustine", "scallop",
+        "clam", "mussel", "oyster", "cockle", "squid", "calamari", "octopus",
+        "oyster sauce",
+    ],
+    "fish": [
+        "fish", "salmon", "tuna", "cod", "anchovy", "anchovies", "sardine", "mackerel",
+        "trout", "tilapia", "haddock", "halibut", "snapper", "fish sauce", "bonito",
+    ],
+    "dairy": [
+        "milk", "butter", "cheese", "cream", "yogurt", "yoghurt", "ghee", "whey",
+        "casein", "paneer", "buttermilk", "mozzarella", "parmesan", "cheddar",
+        "ricotta", "feta", "mascarpone", "custard", "ice cream", "dairy",
+    ],
+    "eggs": ["egg", "egg yolk", "egg white", "mayonnaise", "mayo", "meringue"],
+    "gluten": [
+        "wheat", "flour", "bread", "breadcrumb", "panko", "pasta", "spaghetti",
+        "noodle", "barley", "rye", "couscous", "semolina", "bulgur", "seitan",
+        "tortilla", "pita", "gluten",
+    ],
+    "soy": ["soy", "soya", "soybean", "tofu", "tempeh", "edamame", "miso", "soy sauce"],
+    "sesame": ["sesame", "sesame oil", "tahini"],
+    "pork": [
+        "pork", "bacon", "ham", "lard", "prosciutto", "pancetta", "chorizo",
+        "pepperoni", "salami", "gelatin", "gelatine",
+    ],
+    "meat": [
+        "beef", "steak", "lamb", "mutton", "veal", "venison",
+        "sausage", "meatball", "brisket", "ribs", "meat",
+    ],
+    "poultry": ["chicken", "turkey", "duck", "goose", "quail"],
+    "alcohol": ["wine", "beer", "rum", "vodka", "brandy", "sake", "mirin", "liqueur", "whisky", "whiskey"],
+    "honey": ["honey"],
+}
+
+# What users type into "allergies" -> food group(s) in INGREDIENT_SYNONYMS.
+# A bare "nuts" could mean either, so it rules out both.
+ALLERGY_ALIASES = {
+    "peanut": "peanuts",
+    "nut": ("peanuts", "tree nuts"),
+    "nuts": ("peanuts", "tree nuts"),
+    "tree nut": "tree nuts",
+    "seafood": "shellfish",
+    "crustacean": "shellfish",
+    "crustaceans": "shellfish",
+    "milk": "dairy",
+    "lactose": "dairy",
+    "egg": "eggs",
+    "wheat": "gluten",
+    "soya": "soy",
+    "soybean": "soy",
+    "soybeans": "soy",
+}
+
+# Food groups ruled out by each dietary preference.
+DIET_RESTRICTIONS = {
+    "vegetarian": ["meat", "poultry", "pork", "fish", "shellfish"],
+    "vegan": ["meat", "poultry", "pork", "fish", "shellfish", "dairy", "eggs", "honey"],
+    "pescatarian": ["meat", "poultry", "pork"],
+    "halal": ["pork", "alcohol"],
+    "kosher": ["pork", "shellfish"],
+    "dairy-free": ["dairy"],
+    "lactose-free": ["dairy"],
+    "gluten-free": ["gluten"],
+}
+
+# Phrases that contain a forbidden term but are safe for that food group,
+# e.g. "almond milk" is not dairy (it is still caught as a tree nut).
+EXEMPT_PHRASES = {
+    "dairy": [
+        "almond milk", "oat milk", "soy milk", "rice milk", "coconut milk", "cashew milk",
+        "coconut cream", "cream of tartar", "peanut butter", "almond butter", "nut butter",
+        "cashew butter", "apple butter", "cocoa butter", "butter beans",
+        "cream crackers",
+    ],
+    "meat": ["coconut meat", "crab meat"],
+    "gluten": ["rice flour", "almond flour", "coconut flour", "chickpea flour", "rice noodle"],
+    "tree nuts": ["water chestnut"],
+    "shellfish": ["oyster mushroom"],
+}
+
+# A forbidden term preceded by one of these is a substitution, not a use.
+NEGATING_PREFIXES = (
+    "no ", "without ", "instead of ", "in place of ", "omit ", "omitting ", "free of ",
+    "substitute for ", "vegan ", "plant-based ", "plant based ", "non-dairy ",
+    "dairy-free ", "egg-free ", "meat-free ", "nut-free ", "gluten-free ", "mock ",
+)
+NEGATING_SUFFIXES = ("-free", " free", "-less", " substitute", " alternative")
+
+# Characters held back before a candidate match is confirmed, so exemptions
+# such as "butter beans" or suffixes such as "-free" can still arrive.
+LOOKAHEAD = max(
+    max(len(p) for phrases in EXEMPT_PHRASES.values() for p in phrases),
+    max(len(s) for s in NEGATING_SUFFIXES) + 2,
+)
+
+# Section headings, matched loosely ("## Ingredients", "Ingredients (serves 2):",
+# "**Ingredients for the sauce:**") after markdown is stripped.
+RECIPE_HEADING = re.compile(r"recipe\b")
+INGREDIENTS_HEADING = re.compile(r"ingredients?\b")
+STEPS_HEADING = re.compile(r"(instructions|directions|method|preparation|steps?)\b")
+# A line without a colon only counts as a heading if it is this short
+MAX_HEADING_LENGTH = 40
+
+# Rough chars-per-token for Gemini output, used when reporting savings.
+CHARS_PER_TOKEN = 4
+
+
+class DietViolation(Exception):
+    def __init__(self, group, term, position):
+        super().__init__(f"'{term}' violates {group} restriction")
+        self.group = group
+        self.term = term
+        self.position = position
+
+
+class IngredientMatcher:
+    # Aho-Corasick automaton over every surface form of the forbidden food groups.
+
+    def __init__(self, patterns):
+        # patterns: iterable of (term, group)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for term, group in patterns:
+            self._add(term.lower(), group)
+        self._build_failure_links()
+
+    def _add(self, term, group):
+        node = 0
+        for ch in term:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append((term, group))
+
+    def _build_failure_links(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def step(self, state, ch):
+        while state and ch not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(ch, 0)
+
+    @property
+    def empty(self):
+        return len(self.goto) == 1
+
+
+def forbidden_groups(messagesample_data):
+    # Map a user's food_preferences onto the food groups we must keep out of recipes.
+    if not messagesample_data:
+        return ()
+    food_prefs = messagesample_data.get("user", {}).get("food_preferences", {})
+    allergies = food_prefs.get("allergies", []) or []
+    diets = food_prefs.get("dietary_preference", []) or []
+    if isinstance(allergies, str):
+        allergies = allergies.split(",")
+    if isinstance(diets, str):
+        diets = diets.split(",")
+
+    groups = set()
+    for allergy in allergies:
+        name = allergy.strip().lower()
+        if not name:
+            continue
+        aliases = ALLERGY_ALIASES.get(name, name)
+        for alias in (aliases,) if isinstance(aliases, str) else aliases:
+            if alias in INGREDIENT_SYNONYMS:
+                groups.add(alias)
+            else:
+                # Unknown allergen: guard against the word itself, in any number
+                groups.add(f"custom:{singular(alias)}")
+    for diet in diets:
+        groups.update(DIET_RESTRICTIONS.get(diet.strip().lower(), ()))
+    return tuple(sorted(groups))
+
+
+def singular(term):
+    # "strawberries" -> "strawberry", "tomatoes" -> "tomato", "mushrooms" -> "mushroom";
+    # only the last word of a phrase is changed.
+    if term.endswith("ies") and len(term) > 4:
+        return term[:-3] + "y"
+    if term.endswith(("oes", "ches", "shes", "xes", "sses")):
+        return term[:-2]
+    if term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        return term[:-1]
+    return term
+
+
+def surface_forms(term):
+    # The matcher already allows a trailing "s"/"es"; "-y" plurals need their own form
+    if term.endswith("y") and len(term) > 2 and term[-2] not in "aeiou":
+        return [term, term[:-1] + "ies"]
+    return [term]
+
+
+@lru_cache(maxsize=256)
+def compile_matcher(groups):
+    # Matchers are cached per distinct set of restrictions, so users with the
+    # same profile share one automaton.
+    patterns = []
+    for group in groups:
+        if group.startswith("custom:"):
+            patterns.extend((term, group) for term in surface_forms(group[len("custom:"):]))
+        else:
+            patterns.extend((term, group) for term in INGREDIENT_SYNONYMS[group])
+    return IngredientMatcher(patterns)
+
+
+class DietGuard:
+    # Incremental scanner for one generation. Only the "Recipe:" title line and
+    # the "Ingredients:" section are checked, so prose such as "since you are
+    # allergic to peanuts..." does not trip the guard. If no ingredients
+    # heading is ever recognised, the whole answer is checked at the end.
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.text = ""
+        self._lower = ""
+        self._pos = 0
+        self._state = 0
+        self._line = ""
+        self._in_title = False
+        self._in_ingredients = False
+        self._seen_ingredients = False
+        self._pending = []
+        # Matches anywhere in the text, for the fallback
+        self._any_state = 0
+        self._unscoped = []
+
+    def feed(self, chunk):
+        # Returns a DietViolation as soon as one is confirmed, else None.
+        if not chunk:
+            return None
+        self.text += chunk
+        if self.matcher.empty:
+            return None
+        self._lower += chunk.lower()
+        while self._pos < len(self._lower):
+            self._advance(self._lower[self._pos])
+            self._pos += 1
+        return self._confirm(final=False)
+
+    def finish(self):
+        if self.matcher.empty:
+            return None
+        if not self._seen_ingredients:
+            # Unrecognised layout: fail closed and check everything
+            self._pending = self._unscoped
+        return self._confirm(final=True)
+
+    def _matches(self, state):
+        end = self._pos + 1
+        for term, group in self.matcher.output[state]:
+            start = end - len(term)
+            if start > 0 and self._lower[start - 1].isalpha():
+                continue
+            yield (start, end, term, group)
+
+    def _heading(self, heading):
+        if INGREDIENTS_HEADING.match(heading):
+            self._in_ingredients = self._seen_ingredients = True
+        elif STEPS_HEADING.match(heading):
+            self._in_ingredients = False
+
+    def _advance(self, ch):
+        self._any_state = self.matcher.step(self._any_state, ch)
+        self._unscoped.extend(self._matches(self._any_state))
+
+        if ch == "\n":
+            heading = self._line.strip(" -")
+            if len(heading) <= MAX_HEADING_LENGTH and ":" not in heading:
+                self._heading(heading)
+            self._line = ""
+            self._in_title = False
+            self._state = 0
+            return
+        if ch not in "*#_":
+            self._line += ch
+        if ch == ":":
+            heading = self._line.lstrip(" -")
+            if RECIPE_HEADING.match(heading):
+                self._in_title = True
+            else:
+                self._heading(heading)
+            self._state = 0
+            return
+        if not (self._in_title or self._in_ingredients):
+            return
+
+        self._state = self.matcher.step(self._state, ch)
+        self._pending.extend(self._matches(self._state))
+
+    def _confirm(self, final):
+        available = len(self._lower)
+        still_pending = []
+        for start, end, term, group in self._pending:
+            if not final and end + LOOKAHEAD > available:
+                still_pending.append((start, end, term, group))
+                continue
+            if self._is_violation(start, end, group):
+                self._pending = []
+                return DietViolation(group.replace("custom:", ""), self.text[start:end], start)
+        self._pending = still_pending
+        return None
+
+    def _is_violation(self, start, end, group):
+        text = self._lower
+        # Whole words only, allowing a plural "s"/"es"
+        tail = text[end:end + 3]
+        if tail[:1].isalpha():
+            if tail[:2] == "es":
+                tail = tail[2:]
+            elif tail[:1] == "s":
+                tail = tail[1:]
+            else:
+                return False
+            if tail[:1].isalpha():
+                return False
+
+        before = text[max(0, start - 16):start]
+        if before.endswith(NEGATING_PREFIXES):
+            return False
+        after = text[end:end + LOOKAHEAD].lstrip("s")
+        if after.startswith(NEGATING_SUFFIXES):
+            return False
+
+        for phrase in EXEMPT_PHRASES.get(group, ()):
+            window_start = max(0, start - len(phrase))
+            idx = text.find(phrase, window_start, end + len(phrase))
+            while idx != -1 and idx <= start:
+                if idx + len(phrase) >= end:
+                    return False
+                idx = text.find(phrase, idx + 1, end + len(phrase))
+        return True
+
+
+class GuardStats:
+    # Tracks what early aborts saved compared with letting generation finish.
+    # Full-generation size and speed are running averages of unaborted runs.
+
+    def __init__(self, default_tokens=450, default_seconds_per_token=0.012):
+        self.generations = 0
+        self.completed = 0
+        self.aborts = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+        self._avg_tokens = default_tokens
+        self._avg_seconds_per_token = default_seconds_per_token
+
+    def record_completed(self, text, seconds):
+        tokens = estimate_tokens(text)
+        self.generations += 1
+        self.completed += 1
+        self._avg_tokens += (tokens - self._avg_tokens) / self.completed
+        if tokens:
+            self._avg_seconds_per_token += (seconds / tokens - self._avg_seconds_per_token) / self.completed
+
+    def record_abort(self, text, seconds):
+        tokens = estimate_tokens(text)
+        saved_tokens = max(0, round(self._avg_tokens) - tokens)
+        saved_seconds = saved_tokens * self._avg_seconds_per_token
+        self.generations += 1
+        self.aborts += 1
+        self.tokens_saved += saved_tokens
+        self.seconds_saved += saved_seconds
+        return saved_tokens, saved_seconds
+
+    def as_dict(self):
+        return {
+            "generations": self.generations,
+            "completed": self.completed,
+            "aborts": self.aborts,
+            "tokens_saved": self.tokens_saved,
+            "seconds_saved": round(self.seconds_saved, 3),
+            "avg_full_generation_tokens": round(self._avg_tokens),
+        }
+
+
+guard_stats = GuardStats()
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def tightened_instruction(violations):
+    # Extra instruction appended to the user's message when retrying
+    lines = ["IMPORTANT: your previous answer was rejected because it used ingredients the user cannot eat."]
+    for v in violations:
+        terms = INGREDIENT_SYNONYMS.get(v.group, [v.group])
+        lines.append(
+            f"Do NOT use {v.term} or any other {v.group} ({', '.join(terms)})."
+        )
+    lines.append("Choose a recipe that naturally avoids these ingredients.")
+    return "\n".join(lines)
+
+
+async def guarded_generate(chain, inputs, messagesample_data, max_retries=2, on_token=None):
+    # Stream a chain response through the diet guard. On a violation the
+    # upstream stream is closed immediately and the request is retried with a
+    # tightened prompt. The last attempt is allowed to run to completion.
+    # on_token, if given, is awaited with each chunk, and with None when a
+    # draft has been thrown away for a retry.
+    matcher = compile_matcher(forbidden_groups(messagesample_data))
+    if matcher.empty and on_token is None:
+        response = await chain.ainvoke(inputs)
+        return response.content
+
+    violations = []
+    original_input = inputs["input"]
+    for attempt in range(max_retries + 1):
+        last_attempt = attempt == max_retries
+        attempt_inputs = dict(inputs)
+        if violations:
+            attempt_inputs["input"] = f"{original_input}\n\n{tightened_instruction(violations)}"
+
+        guard = DietGuard(matcher)
+        violation = None
+        started = time.perf_counter()
+        stream = chain.astream(attempt_inputs)
+        try:
+            async for chunk in stream:
+                if on_token:
+                    await on_token(chunk.content)
+                violation = guard.feed(chunk.content) or violation
+                if violation and not last_attempt:
+                    break
+            else:
+                violation = violation or guard.finish()
+        finally:
+            await stream.aclose()
+        elapsed = time.perf_counter() - started
+
+        if violation is None:
+            guard_stats.record_completed(guard.text, elapsed)
+            return guard.text
+
+        if last_attempt:
+            guard_stats.record_completed(guard.text, elapsed)
+            logger.warning("Diet guard: retries exhausted, last answer still uses '%s'", violation.term)
+            note = (
+                f"\n\nNote: this recipe contains {violation.term}, which conflicts with your "
+                f"{violation.group} restriction. Please swap it out."
+            )
+            if on_token:
+                await on_token(note)
+            return guard.text + note
+
+        saved_tokens, saved_seconds = guard_stats.record_abort(guard.text, elapsed)
+        logger.info(
+            "Diet guard aborted generation on '%s' (%s) after ~%s tokens; saved ~%s tokens / %.2fs",
+            violation.term, violation.group, estimate_tokens(guard.text), saved_tokens, saved_seconds
+        )
+        violations.append(violation)
+        if on_token:
+            await on_token(None)
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import resilience
+from resilience import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, LatencyTracker,
+    bounded, call_backend, deadline, hedged
+)
+
+# Fault-injecting stand-ins for Express and Gemini, and the scenarios used to
+# validate deadlines, hedging and circuit breakers: python fault_stubs.py
+
+
+class StubExpress:
+    # Serves /user-details (and accepts any POST) on a local port. `mode` is
+    # "ok", "slow", "hang" or "error".
+
+    def __init__(self, mode="ok", delay=0.0):
+        self.mode = mode
+        self.delay = delay
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.mode == "hang":
+                    time.sleep(3600)
+                if stub.mode == "slow":
+                    time.sleep(stub.delay)
+                if stub.mode == "error":
+                    self.send_response(500)
+                    self.end_headers()
+                    self.wfile.write(b"Server Error")
+                    return
+                body = json.dumps({"user": {"age": 30, "calorie_target": 2000, "food_preferences": {}}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                stub.requests += 1
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(500 if stub.mode == "error" else 201)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.url = f"{self.base_url}/user-details"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+class StubResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+class StubLLM:
+    # ainvoke() with a long-tail latency distribution and optional failures.
+
+    def __init__(self, fast=0.02, slow=1.0, slow_rate=0.03, fail_rate=0.0, seed=0):
+        self.fast = fast
+        self.slow = slow
+        self.slow_rate = slow_rate
+        self.fail_rate = fail_rate
+        self.calls = 0
+        self.rng = random.Random(seed)
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        roll = self.rng.random()
+        if roll < self.fail_rate:
+            raise RuntimeError("503 from stub Gemini")
+        await asyncio.sleep(self.slow if roll < self.fail_rate + self.slow_rate else self.fast)
+        return StubResponse("450")
+
+
+def timed(fn):
+    started = time.perf_counter()
+    try:
+        fn()
+        outcome = "ok"
+    except Exception as e:
+        outcome = type(e).__name__
+    return outcome, time.perf_counter() - started
+
+
+def express_hang_is_bounded():
+    stub = StubExpress("hang")
+    resilience.express_breaker = CircuitBreaker("express")
+    with deadline(0.3):
+        outcome, elapsed = timed(lambda: call_backend("get", stub.url))
+    print(f"express hang, 0.3s deadline: {outcome} after {elapsed:.2f}s")
+    assert outcome == "DeadlineExceeded" and elapsed < 0.6
+
+
+def express_errors_open_breaker():
+    stub = StubExpress("error")
+    breaker = resilience.express_breaker = CircuitBreaker("express", failure_threshold=3, reset_timeout=0.5)
+    outcomes = [timed(lambda: call_backend("get", stub.url)) for _ in range(5)]
+    print("express 500s: " + ", ".join(f"{o} {t * 1000:.1f}ms" for o, t in outcomes))
+    assert [o for o, _ in outcomes] == ["HTTPError"] * 3 + ["CircuitOpenError"] * 2
+    assert stub.requests == 3
+
+    stub.mode = "ok"
+    time.sleep(0.55)
+    outcome, _ = timed(lambda: call_backend("get", stub.url))
+    print(f"express recovered after reset timeout: {outcome}, breaker {breaker.state}")
+    assert outcome == "ok" and breaker.state == "closed"
+    stub.close()
+
+
+async def run_llm_calls(llm, n, hedge):
+    tracker = LatencyTracker(default=0.1)
+    latencies = []
+    for i in range(n):
+        started = time.perf_counter()
+        if hedge:
+            await hedged(lambda: llm.ainvoke("calories?"), tracker, breaker=CircuitBreaker("gemini"))
+        else:
+            await llm.ainvoke("calories?")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def p(latencies, q):
+    return statistics.quantiles(latencies, n=100)[q - 1]
+
+
+async def hedging_cuts_tail():
+    n = 300
+    plain = await run_llm_calls(StubLLM(seed=1), n, hedge=False)
+    llm = StubLLM(seed=1)
+    hedgy = await run_llm_calls(llm, n, hedge=True)
+    print(
+        f"LLM 3% slow tail: p50 {p(plain, 50) * 1000:.0f}ms -> {p(hedgy, 50) * 1000:.0f}ms, "
+        f"p99 {p(plain, 99) * 1000:.0f}ms -> {p(hedgy, 99) * 1000:.0f}ms, "
+        f"{llm.calls - n} extra calls ({(llm.calls - n) / n:.0%})"
+    )
+    assert p(hedgy, 99) < p(plain, 99) / 2
+
+
+async def gemini_failures_fail_fast():
+    breaker = CircuitBreaker("gemini", failure_threshold=3)
+    llm = StubLLM(fail_rate=1.0)
+    outcomes = []
+    for _ in range(5):
+        started = time.perf_counter()
+        try:
+            await hedged(lambda: llm.ainvoke("hi"), LatencyTracker(), breaker=breaker)
+            outcome = "ok"
+        except (RuntimeError, CircuitOpenError) as e:
+            outcome = type(e).__name__
+        outcomes.append((outcome, time.perf_counter() - started))
+    print("gemini down: " + ", ".join(f"{o} {t * 1000:.1f}ms" for o, t in outcomes))
+    assert outcomes[-1][0] == "CircuitOpenError" and outcomes[-1][1] < 0.01
+
+
+async def deadline_bounds_hedged_call():
+    llm = StubLLM(fast=5.0, slow_rate=0.0)
+    started = time.perf_counter()
+    try:
+        with deadline(0.2):
+            await hedged(lambda: llm.ainvoke("hi"), LatencyTracker(default=0.05), breaker=CircuitBreaker("gemini"))
+        outcome = "ok"
+    except DeadlineExceeded:
+        outcome = "DeadlineExceeded"
+    elapsed = time.perf_counter() - started
+    print(f"hung LLM, 0.2s deadline: {outcome} after {elapsed:.2f}s")
+    assert outcome == "DeadlineExceeded" and elapsed < 0.3
+
+
+async def hung_llm_opens_breaker():
+    # Calls cut off by the deadline count as failures, for hedged and streamed calls
+    llm = StubLLM(fast=5.0, slow_rate=0.0)
+    for call in (
+        lambda breaker: hedged(lambda: llm.ainvoke("hi"), LatencyTracker(default=0.05), breaker=breaker),
+        lambda breaker: bounded(lambda: llm.ainvoke("hi"), breaker=breaker),
+    ):
+        breaker = CircuitBreaker("gemini", failure_threshold=3)
+        outcomes = []
+        for _ in range(5):
+            try:
+                with deadline(0.1):
+                    await call(breaker)
+                outcomes.append("ok")
+            except (DeadlineExceeded, CircuitOpenError) as e:
+                outcomes.append(type(e).__name__)
+            await asyncio.sleep(0)  # let cancelled attempts report to the breaker
+        print(f"hung LLM, 0.1s deadlines: {', '.join(outcomes)}; breaker {breaker.state}")
+        assert outcomes[-1] == "CircuitOpenError" and breaker.state == "open"
+
+
+async def half_open_trial_outlives_hedge():
+    # A healthy but slow trial call must not be abandoned when the breaker
+    # rejects its hedge
+    breaker = CircuitBreaker("gemini", failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    await asyncio.sleep(0.06)
+    llm = StubLLM(fast=0.2, slow_rate=0.0)
+    outcome, _ = await atimed(hedged(lambda: llm.ainvoke("hi"), LatencyTracker(default=0.05), breaker=breaker))
+    print(f"slow trial through half-open breaker: {outcome}, breaker {breaker.state}")
+    assert outcome == "ok" and breaker.state == "closed"
+
+
+async def atimed(coro):
+    started = time.perf_counter()
+    try:
+        await coro
+        outcome = "ok"
+    except Exception as e:
+        outcome = type(e).__name__
+    return outcome, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    express_hang_is_bounded()
+    express_errors_open_breaker()
+    asyncio.run(hedging_cuts_tail())
+    asyncio.run(gemini_failures_fail_fast())
+    asyncio.run(deadline_bounds_hedged_call())
+    asyncio.run(hung_llm_opens_breaker())
+    asyncio.run(half_open_trial_outlives_hedge())
+    print("all fault scenarios passed")
@@ -1,23 +1,32 @@
+import asyncio
+import hmac
 import logging
 import os
 import json
-from fastapi import FastAPI, HTTPException, Request
+from collections import defaultdict
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
-import requests
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import Cookie
+from fastapi import Cookie, Header
 import re
-
-# Setup logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    handlers=[logging.FileHandler("langchain.log"), logging.StreamHandler()]
+import uuid
+from diet_guard import guarded_generate, guard_stats
+from meal_suggestions import SuggestionStore
+from analytics import analytics_store, default_range, to_day
+from typing import Optional, Union
+from log_config import request_id_var, setup_logging
+from resilience import (
+    CircuitOpenError, DeadlineExceeded, LatencyTracker, ResponseCache,
+    bounded, call_backend, deadline, express_breaker, gemini_breaker, hedged
 )
+
+# Setup logging (LOG_MODE=production for queued, sampled JSON logs)
+setup_logging("langchain.log")
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -29,6 +38,9 @@ if not api_key:
 # Initialize FastAPI app
 app = FastAPI()
 
+# Express backend
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:3000")
+
 # Initialize LangChain with Gemini
 llm = ChatGoogleGenerativeAI(
     model="gemini-2.0-flash",
@@ -39,9 +51,11 @@ llm = ChatGoogleGenerativeAI(
 # Define Pydantic models for request bodies
 class ChatRequest(BaseModel):
     message: str
+    conversation: Optional[Union[int, str]] = None
 
 class SaveRecipeRequest(BaseModel):
     sessionid: str
+    conversation: Optional[Union[int, str]] = None
 
 class CalculateCaloriesRequest(BaseModel):
     mname: str
@@ -49,6 +63,12 @@ class CalculateCaloriesRequest(BaseModel):
     recipe_instruction: str
     calories: int = 0
 
+class MealLoggedRequest(BaseModel):
+    userid: str
+    date: str
+    calories: float
+    calorie_goal: Optional[int] = None
+
 # HTTP request functions
 #def save_chat_history_to_db(chatbot_history, sessionid):
 #    url = "http://localhost:3000/chatbot-history"
@@ -67,28 +87,57 @@ class CalculateCaloriesRequest(BaseModel):
 #    except Exception as e:
 #        logger.error(f"Error saving chat history to DB: {e}")
 
+# Every request gets an end-to-end deadline that all outbound calls draw from
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    with deadline():
+        return await call_next(request)
+
+# Tag every log record with the request id, echoed back to the caller
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # CORS middleware for frontend access
+ALLOWED_ORIGINS = ["http://localhost:5173"]  # your frontend
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:5173"],  # your frontend
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Last good answers, served when Gemini or Express is unhealthy
+preferences_cache = ResponseCache()
+chat_response_cache = ResponseCache()
+chat_latency = LatencyTracker()
+calorie_latency = LatencyTracker(default=1.0)
+
+DEGRADED_CHAT_RESPONSE = (
+    "The recipe assistant is temporarily unavailable. Please try again in a minute."
+)
+
 def save_recent_prompt_to_db(user_input, assistant_response, sessionid):
-    url = "http://localhost:3000/chatbot-history"
+    url = f"{BACKEND_URL}/chatbot-history"
     cookies = {"sessionid": sessionid}
     data = {"query": user_input, "response": assistant_response}
     try:
-        response = requests.post(url, json=data, cookies=cookies)
+        response = call_backend("post", url, json=data, cookies=cookies)
         if response.status_code != 201:
-            logger.error(f"Failed to save recent prompt to DB: {response.text}")
+            logger.error("Failed to save recent prompt to DB: %s", response.text)
     except Exception as e:
-        logger.error(f"Error saving recent prompt to DB: {e}")
+        logger.error("Error saving recent prompt to DB: %s", e)
 
 def save_recipe_to_db(json_string, sessionid):
-    url = "http://localhost:3000/user-recipes"
+    url = f"{BACKEND_URL}/user-recipes"
     headers = {"Cookie": f"sessionid={sessionid}"}
     try:
         recipe_data = json.loads(json_string)
@@ -117,31 +166,31 @@ def save_recipe_to_db(json_string, sessionid):
             "calories": recipe_data["calories"]
         }
 
-        response = requests.post(url, json=data, headers=headers)
+        response = call_backend("post", url, json=data, headers=headers)
         if response.status_code != 201:
-            logger.error(f"Failed to save recipe to DB: {response.text}")
+            logger.error("Failed to save recipe to DB: %s", response.text)
         else:
-            logger.info(f"Recipe saved successfully: {response.json()}")
+            logger.info("Recipe saved successfully: %s", response.text)
     except Exception as e:
-        logger.error(f"Error saving recipe to DB: {e}")
+        logger.error("Error saving recipe to DB: %s", e)
 
 
 def load_user_preferences_from_db(sessionid):
-    url = "http://localhost:3000/user-details"
+    url = f"{BACKEND_URL}/user-details"
     cookie = {"sessionid": sessionid}
     try:
-        response = requests.get(url, cookies=cookie)
+        response = call_backend("get", url, cookies=cookie)
         if response.status_code != 200:
-            logger.error(f"Failed to fetch user preferences: {response.text}")
+            logger.error("Failed to fetch user preferences: %s", response.text)
             return None
 
         raw_data = response.json()
-        logger.debug(f"user_data from /user-details: {raw_data}")
+        logger.debug("user_data from /user-details: %s", raw_data)
 
         user_info = raw_data.get("user", {})
         food_prefs = user_info.get("food_preferences", {})
 
-        return {
+        preferences = {
             "user": {
                 "age": user_info.get("age", "unknown"),
                 "calorie_target": user_info.get("calorie_target", 2000),
@@ -152,10 +201,13 @@ def load_user_preferences_from_db(sessionid):
             },
             "ingredients": ""  # You may later populate this
         }
+        preferences_cache.put(sessionid, preferences)
+        return preferences
 
     except Exception as e:
-        logger.error(f"Error fetching user preferences from DB: {e}")
-        return None
+        # Serve the last known preferences while Express is unhealthy
+        logger.error("Error fetching user preferences from DB: %s", e)
+        return preferences_cache.get(sessionid)
 
 # Load messagesample.json for fallback (as in chatbot.py)
 def load_messagesample():
@@ -175,7 +227,7 @@ def load_messagesample():
         logger.debug("No valid messagesample.json found, using default context")
         return None
     except Exception as e:
-        logger.error(f"Error loading messagesample.json: {e}")
+        logger.error("Error loading messagesample.json: %s", e)
         return None
 
 # Format system prompt (adapted from format_context)
@@ -225,27 +277,41 @@ prompt = ChatPromptTemplate.from_messages([
 # Initialize LangChain chain
 chain = prompt | llm
 
-# In-memory chat history (per sessionid)
+# Retries with a tightened prompt when a streamed recipe breaks the user's diet
+DIET_GUARD_MAX_RETRIES = int(os.getenv("DIET_GUARD_MAX_RETRIES", "2"))
+
+# Precomputed meal suggestions, filled offline by meal_suggestions.py
+suggestion_store = SuggestionStore()
+
+# In-memory chat history, per sessionid and optional client conversation id.
+# HTTP and WebSocket turns share these keys, so either transport can pick up
+# the other's chat.
 chat_histories = {}
+
+def chat_history_key(sessionid, conversation=None):
+    if conversation is None or conversation == "":
+        return sessionid
+    return f"{sessionid}:{conversation}"
+
 # Get the chat history
 def get_latest_response(sessionid):
-    url = "http://localhost:3000/chatbot-history"
+    url = f"{BACKEND_URL}/chatbot-history"
     headers = {"Cookie": f"sessionid={sessionid}"}
     try:
-        response = requests.get(url, headers)
+        response = call_backend("get", url, headers=headers)
         if response.status_code != 200:
-            logger.error(f"Failed to fetch user preferences: {response.text}")
+            logger.error("Failed to fetch user preferences: %s", response.text)
             return None
         history = response.json()
         return history
     except Exception as e:
-        logger.error(f"Error fetching user preferences from DB: {e}")
+        logger.error("Error fetching user preferences from DB: %s", e)
         return None
 
 # Save latest response as JSON (adapted from save_latest_response)
-def save_latest_response(sessionid):
+def save_latest_response(sessionid, history_key=None):
     try:
-        history = chat_histories.get(sessionid, [])
+        history = chat_histories.get(history_key or sessionid, [])
         if not history:
             logger.warning("No chat history found")
             return json.dumps({"error": "No chat history available"}, indent=2)
@@ -315,105 +381,292 @@ def save_latest_response(sessionid):
         return json.dumps(recipe_data, indent=2)
 
     except Exception as e:
-        logger.error(f"Error in save_latest_response: {e}")
+        logger.error("Error in save_latest_response: %s", e)
         return json.dumps({"error": str(e)}, indent=2)
 
 
 # FastAPI endpoints
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "circuits": {
+            "express": express_breaker.as_dict(),
+            "gemini": gemini_breaker.as_dict()
+        }
+    }
+
+@app.get("/diet-guard/stats")
+async def diet_guard_stats():
+    return guard_stats.as_dict()
+
+LOG_MEAL_MISSING_RESPONSE = "I couldn't find a recent recipe to log. Please ask for a recipe first, then say 'Log meal'."
+
+# Handle a "Log meal" command; returns the reply and the saved recipe (or None)
+def log_meal(message, sessionid, history_key=None):
+    # Try to save the most recent recipe
+    recipe_json = save_latest_response(sessionid, history_key)
+    recipe_data = json.loads(recipe_json)
+
+    if "error" not in recipe_data:
+        # If save was successful, return confirmation message
+        return {
+            "query": message,
+            "response": f"Recipe '{recipe_data.get('mname', '')}' successfully saved to your log!"
+        }, recipe_data
+    return {"query": message, "response": LOG_MEAL_MISSING_RESPONSE}, None
+
+# Preferences, system prompt and chain for a session. HTTP builds these per
+# request; the WebSocket builds them once per connection. Blocking, so run it
+# in a worker thread. Without fallback, returns None for a session Express
+# does not recognise.
+def load_chat_context(sessionid, fallback=True):
+    messagesample_data = load_user_preferences_from_db(sessionid)
+
+    if messagesample_data:
+        suggestion_store.record_profile(messagesample_data)
+    elif fallback:
+        messagesample_data = load_messagesample()
+    else:
+        return None
+    system_prompt_local = format_context(messagesample_data)
+
+    # Update prompt with user-specific system prompt
+    prompt_local = ChatPromptTemplate.from_messages([
+        ("system", system_prompt_local),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}")
+    ])
+    return messagesample_data, system_prompt_local, prompt_local | llm
+
+# One chat turn. With on_token the answer is streamed, otherwise it is hedged.
+async def chat_turn(message, sessionid, context, history_key=None, on_token=None):
+    messagesample_data, system_prompt_local, chain_local = context
+    history_key = history_key or sessionid
+
+    # Get or initialize chat history
+    if history_key not in chat_histories:
+        chat_histories[history_key] = []
+    chatbot_history = chat_histories[history_key]
+
+    # Append user message
+    chatbot_history.append(HumanMessage(content=message))
+
+    # Convert history to LangChain format
+    langchain_history = [
+        HumanMessage(content=msg.content) if isinstance(msg, dict) and msg.get("role") == "user" else
+        AIMessage(content=msg.content) if isinstance(msg, dict) and msg.get("role") == "assistant" else
+        msg
+        for msg in chatbot_history
+        if isinstance(msg, (dict, HumanMessage, AIMessage))
+    ]
+
+    # Invoke LangChain chain, aborting early if the recipe breaks the user's diet.
+    # An unhealthy Gemini gets a cached or degraded answer.
+    def generate():
+        return guarded_generate(chain_local, {
+            "chat_history": langchain_history,
+            "input": message
+        }, messagesample_data, max_retries=DIET_GUARD_MAX_RETRIES, on_token=on_token)
+
+    cache_key = (system_prompt_local, message)
+    try:
+        if on_token is None:
+            assistant_response = await hedged(generate, chat_latency)
+        else:
+            # A streamed answer cannot be hedged without interleaving tokens
+            assistant_response = await bounded(generate)
+        chat_response_cache.put(cache_key, assistant_response)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.warning("Serving degraded chat response: %s", e)
+        chatbot_history.pop()
+        return {
+            "query": message,
+            "response": chat_response_cache.get(cache_key) or DEGRADED_CHAT_RESPONSE,
+            "degraded": True
+        }
+
+    # Append assistant response
+    chatbot_history.append(AIMessage(content=assistant_response))
+
+    # Save recent prompt to file and DB
+    recent_data = {
+        "query": message,
+        "response": assistant_response
+    }
+    # Off the event loop, so a slow Express does not stall other turns
+    await asyncio.gather(
+        asyncio.to_thread(save_chat_history, recent_data, "recent_prompt"),
+        asyncio.to_thread(save_recent_prompt_to_db, message, assistant_response, sessionid)
+    )
+
+    return {
+        "query": message,
+        "response": assistant_response
+    }
 
 @app.post("/chat")
 async def chat(request: ChatRequest, sessionid: str = Cookie(None)):
     try:
         # First check if this is a "Log meal" command
+        history_key = chat_history_key(sessionid, request.conversation)
         if request.message.strip().lower() == "log meal":
-            # Try to save the most recent recipe
-            recipe_json = save_latest_response(sessionid)
-            recipe_data = json.loads(recipe_json)
-            
-            if "error" not in recipe_data:
-                # If save was successful, return confirmation message
-                return {
-                    "query": request.message,
-                    "response": f"Recipe '{recipe_data.get('mname', '')}' successfully saved to your log!"
-                }
-            else:
-                return {
-                    "query": request.message,
-                    "response": "I couldn't find a recent recipe to log. Please ask for a recipe first, then say 'Log meal'."
-                }
+            response, _ = await asyncio.to_thread(log_meal, request.message, sessionid, history_key)
+            return response
 
         # Normal chat processing for all other messages
         # Load user preferences
         if not sessionid:
             raise HTTPException(status_code=401, detail="No sessionid cookie found")
-        messagesample_data = load_user_preferences_from_db(sessionid)
+        context = await asyncio.to_thread(load_chat_context, sessionid)
+        return await chat_turn(request.message, sessionid, context, history_key)
+    except Exception as e:
+        logger.error("Error processing chat request: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not messagesample_data:
-            messagesample_data = load_messagesample()
-        system_prompt_local = format_context(messagesample_data)
-        
-        # Update prompt with user-specific system prompt
-        prompt_local = ChatPromptTemplate.from_messages([
-            ("system", system_prompt_local),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}")
-        ])
-        chain_local = prompt_local | llm
-        
-        # Get or initialize chat history
-        if sessionid not in chat_histories:
-            chat_histories[sessionid] = []
-        chatbot_history = chat_histories[sessionid]
-        
-        # Append user message
-        chatbot_history.append(HumanMessage(content=request.message))
-        
-        # Convert history to LangChain format
-        langchain_history = [
-            HumanMessage(content=msg.content) if isinstance(msg, dict) and msg.get("role") == "user" else 
-            AIMessage(content=msg.content) if isinstance(msg, dict) and msg.get("role") == "assistant" else 
-            msg
-            for msg in chatbot_history
-            if isinstance(msg, (dict, HumanMessage, AIMessage))
-        ]
-        
-        # Invoke LangChain chain
-        response = await chain_local.ainvoke({
-            "chat_history": langchain_history,
-            "input": request.message
+# Parse one client frame into (id, message, conversation); ValueError if malformed
+def parse_chat_frame(text):
+    if text is None:
+        raise ValueError("Frames must be JSON text")
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        raise ValueError("Frames must be valid JSON")
+    if not isinstance(data, dict):
+        raise ValueError("Frames must be JSON objects")
+    message = data.get("message")
+    conversation = data.get("conversation")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("'message' must be a non-empty string")
+    if conversation is not None and not isinstance(conversation, (int, str)):
+        raise ValueError("'conversation' must be a string or integer")
+    return data.get("id"), message, conversation
+
+# WebSocket chat: authenticate once, keep preferences and chain hot for the
+# connection, and multiplex turns. Client frames are
+#   {"id": ..., "message": ..., "conversation": ...}
+# and the server replies with "token", "reset" (draft discarded by the diet
+# guard), "done" and "error" frames tagged with the same id, plus pushed
+# "notification" frames such as background recipe saves.
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    origin = websocket.headers.get("origin")
+    sessionid = websocket.cookies.get("sessionid")
+    if (origin and origin not in ALLOWED_ORIGINS) or not sessionid:
+        await websocket.close(code=1008)
+        return
+
+    # The session must be one Express recognises
+    connection_id = uuid.uuid4().hex[:12]
+    request_id_var.set(connection_id)
+    with deadline():
+        context = await asyncio.to_thread(load_chat_context, sessionid, False)
+    if context is None:
+        logger.warning("Rejecting chat websocket: invalid session")
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    send_lock = asyncio.Lock()
+    conversation_locks = defaultdict(asyncio.Lock)
+    tasks = set()
+
+    async def send(payload):
+        async with send_lock:
+            await websocket.send_json(payload)
+
+    async def push_recipe_save(turn_id, message, history_key):
+        with deadline():
+            response, recipe_data = await asyncio.to_thread(log_meal, message, sessionid, history_key)
+        await send({
+            "type": "notification",
+            "event": "recipe_saved" if recipe_data else "recipe_not_found",
+            "id": turn_id,
+            "response": response["response"],
+            "recipe": recipe_data
         })
-        
-        # Append assistant response
-        assistant_response = response.content
-        chatbot_history.append(AIMessage(content=assistant_response))
-
-        # Save recent prompt to file and DB
-        recent_data = {
-            "query": request.message,
-            "response": assistant_response
-        }
-        save_chat_history(recent_data, "recent_prompt")
-        save_recent_prompt_to_db(request.message, assistant_response, sessionid)
-        
+
+    async def handle(turn_id, message, conversation):
+        history_key = chat_history_key(sessionid, conversation)
+        request_id_var.set(f"{connection_id}/{turn_id}")
+        async with conversation_locks[history_key]:
+            try:
+                if message.strip().lower() == "log meal":
+                    # Saving goes through Express; acknowledge now, push the result later
+                    spawn(push_recipe_save(turn_id, message, history_key))
+                    await send({"id": turn_id, "type": "done", "query": message, "response": "Saving your latest recipe..."})
+                    return
+
+                async def on_token(text):
+                    if text is None:
+                        await send({"id": turn_id, "type": "reset"})
+                    else:
+                        await send({"id": turn_id, "type": "token", "text": text})
+
+                with deadline():
+                    result = await chat_turn(message, sessionid, context, history_key, on_token=on_token)
+                await send({"id": turn_id, "type": "done", **result})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error("Error processing websocket chat turn: %s", e)
+                await send({"id": turn_id, "type": "error", "detail": str(e)})
+
+    def spawn(coro):
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            try:
+                turn_id, message, conversation = parse_chat_frame(frame.get("text"))
+            except ValueError as e:
+                await send({"id": None, "type": "error", "detail": str(e)})
+                continue
+            spawn(handle(turn_id, message, conversation))
+    except WebSocketDisconnect:
+        logger.debug("Chat websocket disconnected")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.get("/meal-suggestions")
+async def meal_suggestions(sessionid: str = Cookie(None)):
+    if not sessionid:
+        raise HTTPException(status_code=401, detail="No sessionid cookie found")
+    try:
+        # Always derive the profile from current preferences, so edited diets or
+        # allergies take effect immediately
+        messagesample_data = await asyncio.to_thread(load_user_preferences_from_db, sessionid)
+        if not messagesample_data:
+            raise HTTPException(status_code=404, detail="User preferences not found")
+        profile_key = await asyncio.to_thread(suggestion_store.record_profile, messagesample_data)
+        suggestions = await asyncio.to_thread(suggestion_store.get_suggestions, profile_key)
         return {
-            "query": request.message,
-            "response": assistant_response
+            "suggestions": suggestions,
+            # New profiles are picked up by the next batch run
+            "pending": not suggestions
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error processing chat request: {e}")
+        logger.error("Error fetching meal suggestions: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/save-recipe")
 async def save_recipe(request: SaveRecipeRequest):
     try:
         sessionid= request.sessionid
-        json_string = save_latest_response(sessionid)
+        json_string = await asyncio.to_thread(
+            save_latest_response, sessionid, chat_history_key(sessionid, request.conversation)
+        )
         return {"recipe_json": json_string}
     except Exception as e:
-        logger.error(f"Error saving recipe: {e}")
+        logger.error("Error saving recipe: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Save chat history to file (from chatbot.py)
@@ -421,9 +674,9 @@ def save_chat_history(chatbot_history, filename: str):
     try:
         with open(f"{filename}.json", "w", encoding="utf-8") as f:
             json.dump(chatbot_history, f, indent=4, ensure_ascii=False)
-        logger.debug(f"Chat history saved to {filename}.json")
+        logger.debug("Chat history saved to %s.json", filename)
     except Exception as e:
-        logger.error(f"Error saving chat history to JSON: {e}")
+        logger.error("Error saving chat history to JSON: %s", e)
 
 @app.post("/calculate-calories")
 async def calculate_calories(request: CalculateCaloriesRequest, sessionid: str = Cookie(None)):
@@ -444,18 +697,22 @@ async def calculate_calories(request: CalculateCaloriesRequest, sessionid: str =
         """
         
         # Get calorie calculation from LLM
-        response = await llm.ainvoke(calorie_prompt)
+        try:
+            response = await hedged(lambda: llm.ainvoke(calorie_prompt), calorie_latency)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logger.warning("Keeping submitted calories, LLM unavailable: %s", e)
+            response = None
         
         # Extract the calorie number from the response
         try:
             # Look for a number in the response
-            calorie_match = re.search(r'\d+', response.content)
+            calorie_match = re.search(r'\d+', response.content) if response else None
             if calorie_match:
                 calculated_calories = int(calorie_match.group())
             else:
                 calculated_calories = request.calories  # fallback to original if no number found
         except Exception as e:
-            logger.error(f"Error parsing calorie calculation: {e}")
+            logger.error("Error parsing calorie calculation: %s", e)
             calculated_calories = request.calories
         
         # Update the recipe with calculated calories
@@ -467,15 +724,115 @@ async def calculate_calories(request: CalculateCaloriesRequest, sessionid: str =
         }
         
         # Save to database
-        save_recipe_to_db(json.dumps(recipe_data), sessionid)
+        await asyncio.to_thread(save_recipe_to_db, json.dumps(recipe_data), sessionid)
         
         return recipe_data
         
     except Exception as e:
-        logger.error(f"Error calculating calories: {e}")
+        logger.error("Error calculating calories: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Analytics: incremental per-user rollups. Express pushes every meal change,
+# signed with the shared ANALYTICS_SECRET; reads resolve the user from the
+# session and load their full history from Express the first time.
+ANALYTICS_SECRET = os.getenv("ANALYTICS_SECRET")
+# Longest range a single analytics query may cover
+ANALYTICS_MAX_DAYS = 366
+
+# Loads racing with meal changes are retried this many times
+ANALYTICS_LOAD_ATTEMPTS = 3
+
+def load_meal_history(sessionid, meals=True):
+    # With meals=False only the user id and calorie goal are returned
+    url = f"{BACKEND_URL}/meal-history"
+    params = None if meals else {"meals": "0"}
+    response = call_backend("get", url, params=params, cookies={"sessionid": sessionid})
+    if response.status_code != 200:
+        logger.warning("Failed to fetch meal history: %s", response.text)
+        return None
+    return response.json()
+
+async def fetch_meal_history(sessionid, meals=True):
+    try:
+        history = await asyncio.to_thread(load_meal_history, sessionid, meals)
+    except Exception as e:
+        logger.error("Error fetching meal history: %s", e)
+        raise HTTPException(status_code=503, detail="Meal history unavailable")
+    if history is None:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    return history
+
+async def session_rollup(sessionid):
+    if not sessionid:
+        raise HTTPException(status_code=401, detail="No sessionid cookie found")
+    userid = analytics_store.user_for_session(sessionid)
+    if userid is None:
+        user = await fetch_meal_history(sessionid, meals=False)
+        userid = user["userid"]
+        analytics_store.set_goal(userid, user.get("calorie_goal"))
+        analytics_store.remember_session(sessionid, userid)
+        if not ANALYTICS_SECRET:
+            # No notifications can arrive, so reload history when the mapping expires
+            analytics_store.forget(userid)
+
+    # Full history is only read once per user; after that the signed
+    # notifications keep the rollup current
+    for _ in range(ANALYTICS_LOAD_ATTEMPTS):
+        rollup = analytics_store.get(userid)
+        if rollup is not None:
+            return rollup
+        version = analytics_store.version(userid)
+        history = await fetch_meal_history(sessionid)
+        meals = history.get("meals", [])
+        analytics_store.backfill(
+            userid, [to_day(m["date"]) for m in meals], [m["calories"] or 0 for m in meals],
+            history.get("calorie_goal"), version=version
+        )
+    rollup = analytics_store.get(userid)
+    if rollup is None:
+        raise HTTPException(status_code=503, detail="Meal history is changing, please retry")
+    return rollup
+
+def analytics_days(start, end, days=7):
+    try:
+        return default_range(start, end, days, max_days=ANALYTICS_MAX_DAYS)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid date range: {e}")
+
+@app.post("/analytics/meal-logged")
+async def analytics_meal_logged(request: MealLoggedRequest, x_analytics_secret: Optional[str] = Header(None)):
+    if not ANALYTICS_SECRET or not hmac.compare_digest(x_analytics_secret or "", ANALYTICS_SECRET):
+        raise HTTPException(status_code=403, detail="Invalid analytics secret")
+    try:
+        day = to_day(request.date)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid date")
+    applied = analytics_store.record_meal(request.userid, day, request.calories, request.calorie_goal)
+    # Not loaded yet: the user's next read loads full history, including this meal
+    return {"status": "ok" if applied else "skipped"}
+
+@app.get("/analytics/range")
+async def analytics_range(start: Optional[str] = None, end: Optional[str] = None, sessionid: str = Cookie(None)):
+    start_day, end_day = analytics_days(start, end)
+    return (await session_rollup(sessionid)).range(start_day, end_day)
+
+@app.get("/analytics/weekly")
+async def analytics_weekly(date: Optional[str] = None, sessionid: str = Cookie(None)):
+    _, day = analytics_days(None, date)
+    return (await session_rollup(sessionid)).week(day)
+
+@app.get("/analytics/streak")
+async def analytics_streak(date: Optional[str] = None, sessionid: str = Cookie(None)):
+    _, day = analytics_days(None, date)
+    return {"streak": (await session_rollup(sessionid)).streak(day)}
+
+@app.get("/analytics/goal")
+async def analytics_goal(start: Optional[str] = None, end: Optional[str] = None, sessionid: str = Cookie(None)):
+    start_day, end_day = analytics_days(start, end)
+    return (await session_rollup(sessionid)).goal_percentage(start_day, end_day)
+
+
 # Run the FastAPI app
 if __name__ == "__main__":
     import uvicorn
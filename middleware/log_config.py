@@ -0,0 +1,196 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# LOG_MODE=debug (default) keeps the original synchronous DEBUG logging to file
+# and console. LOG_MODE=production moves formatting and I/O to a background
+# thread, writes JSON lines tagged with the request id, and samples and
+# rate-limits noisy messages before a LogRecord is even built.
+LOG_MODE = os.getenv("LOG_MODE", "debug")
+# Production only. DEBUG calls are dropped by this level before sampling, so
+# the DEBUG sample rate only matters with LOG_LEVEL=DEBUG.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# Fraction of records kept per level, e.g. LOG_SAMPLE_RATES="DEBUG=0.05,INFO=0.5"
+DEFAULT_SAMPLE_RATES = {"DEBUG": 0.01, "INFO": 1.0, "WARNING": 1.0, "ERROR": 1.0, "CRITICAL": 1.0}
+# Records per second allowed for a single message (logger + format string), per level
+DEFAULT_RATE_LIMITS = {"DEBUG": 5, "INFO": 20, "WARNING": 10, "ERROR": 10}
+# Rate-limit windows kept before those from past seconds are dropped; libraries
+# that log pre-formatted strings would otherwise add one per message
+MAX_RATE_WINDOWS = 1024
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+_listener = None
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+# Log arguments of these types can be formatted later on the listener thread
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class LogGate:
+    # Sampling per level and rate limiting per message, per second. The first
+    # record let through after a burst carries the number that were dropped.
+
+    def __init__(self, rates, limits):
+        self.rates = {logging.getLevelName(name): rate for name, rate in rates.items()}
+        self.limits = {logging.getLevelName(name): limit for name, limit in limits.items()}
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def check(self, name, level, msg):
+        # None to drop the call, otherwise the number suppressed before it
+        rate = self.rates.get(level, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return None
+        limit = self.limits.get(level)
+        if limit is None:
+            return 0
+        key = (name, msg)
+        now = int(time.monotonic())
+        with self.lock:
+            if key not in self.windows and len(self.windows) >= MAX_RATE_WINDOWS:
+                self.windows = {k: w for k, w in self.windows.items() if w[0] == now}
+                if len(self.windows) >= MAX_RATE_WINDOWS // 2:
+                    # Flooded within a single second; start over
+                    self.windows = {}
+            second, count, suppressed = self.windows.get(key, (now, 0, 0))
+            if second != now:
+                second, count = now, 0
+            if count >= limit:
+                self.windows[key] = (second, count, suppressed + 1)
+                return None
+            self.windows[key] = (second, count + 1, 0)
+        return suppressed
+
+
+class GatedLogger(logging.Logger):
+    # Consults the production LogGate before findCaller and LogRecord
+    # creation, so dropped calls cost next to nothing.
+    gate = None
+
+    def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False, stacklevel=1):
+        gate = GatedLogger.gate
+        if gate is not None:
+            suppressed = gate.check(self.name, level, msg)
+            if suppressed is None:
+                return
+            if suppressed:
+                extra = {**(extra or {}), "suppressed": suppressed}
+        # One extra frame (this one) between the caller and Logger._log
+        super()._log(level, msg, args, exc_info, extra, stack_info, stacklevel + 1)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class LazyQueueHandler(QueueHandler):
+    # The stock QueueHandler formats the message before enqueueing, i.e. on the
+    # request thread. Records whose arguments are all immutable are handed
+    # over as-is and %-formatted on the listener thread. Anything else (dicts,
+    # lists, exceptions) could change before then, so those are formatted
+    # here, as are tracebacks, which reference live frames.
+    def prepare(self, record):
+        # A lone dict argument arrives unwrapped, and is itself mutable
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        if record.args and not all(isinstance(arg, _IMMUTABLE) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(value, defaults):
+    levels = dict(defaults)
+    for item in filter(None, (value or "").split(",")):
+        name, _, number = item.partition("=")
+        levels[name.strip().upper()] = float(number)
+    return levels
+
+
+def shutdown_logging():
+    # Flush queued records and stop the background writer, if any
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def setup_logging(filename, mode=None, stream=None):
+    # Configure the root logger for the given mode; safe to call again to
+    # switch modes.
+    global _listener
+    mode = mode or LOG_MODE
+    shutdown_logging()
+    GatedLogger.gate = None
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+    if mode != "production":
+        logging.basicConfig(
+            level=logging.DEBUG,
+            handlers=[logging.FileHandler(filename), logging.StreamHandler(stream)],
+            force=True
+        )
+        return
+
+    formatter = JsonFormatter()
+    file_handler = logging.FileHandler(filename)
+    stream_handler = logging.StreamHandler(stream)
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+    listener = QueueListener(queue.SimpleQueue(), file_handler, stream_handler, respect_handler_level=True)
+
+    handler = LazyQueueHandler(listener.queue)
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    # Gate every named logger, including those created before this call
+    GatedLogger.gate = LogGate(
+        parse_levels(os.getenv("LOG_SAMPLE_RATES"), DEFAULT_SAMPLE_RATES),
+        parse_levels(os.getenv("LOG_RATE_LIMITS"), DEFAULT_RATE_LIMITS)
+    )
+    logging.setLoggerClass(GatedLogger)
+    for logger in logging.Logger.manager.loggerDict.values():
+        if type(logger) is logging.Logger:
+            logger.__class__ = GatedLogger
+
+    listener.start()
+    _listener = listener
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from diet_guard import DietGuard, compile_matcher, forbidden_groups
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("MEAL_SUGGESTIONS_DB", "meal_suggestions.db")
+MEALS = ("breakfast", "lunch", "dinner", "snack")
+# Calorie targets are bucketed so near-identical users share suggestions
+CALORIE_BAND = 250
+# Only profiles seen within this window are regenerated by the batch job
+ACTIVE_DAYS = 30
+# Suggestions older than this are refreshed even if the profile is unchanged
+MAX_AGE_DAYS = 7
+# Bump when the prompt changes to force a refresh of every profile
+PROMPT_VERSION = 1
+MAX_CONCURRENCY = int(os.getenv("MEAL_SUGGESTIONS_CONCURRENCY", "4"))
+# last_seen only needs day precision, so a profile is written at most this often
+RECORD_INTERVAL = 3600
+
+
+def profile_from_preferences(messagesample_data):
+    # Reduce the output of load_user_preferences_from_db to the fields that
+    # decide what we suggest.
+    user = (messagesample_data or {}).get("user", {})
+    food_prefs = user.get("food_preferences", {})
+    diets = food_prefs.get("dietary_preference", []) or []
+    allergies = food_prefs.get("allergies", []) or []
+    if isinstance(diets, str):
+        diets = diets.split(",")
+    if isinstance(allergies, str):
+        allergies = allergies.split(",")
+    try:
+        calorie_target = int(user.get("calorie_target") or 2000)
+    except (TypeError, ValueError):
+        calorie_target = 2000
+
+    return {
+        "dietary_preference": sorted({d.strip().lower() for d in diets if d.strip() and d.strip().lower() != "none"}),
+        "allergies": sorted({a.strip().lower() for a in allergies if a.strip()}),
+        "calorie_band": (calorie_target // CALORIE_BAND) * CALORIE_BAND,
+    }
+
+
+def profile_key(profile):
+    raw = json.dumps(profile, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class SuggestionStore:
+    # Local SQLite store. Profiles are recorded as users are seen; the batch
+    # job fills suggestions for them and the read endpoint serves from here.
+    # Methods block on SQLite, so call them from a worker thread.
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._recorded = {}
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS profiles (
+                    profile_key TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_profiles_last_seen ON profiles(last_seen);
+                CREATE TABLE IF NOT EXISTS suggestions (
+                    profile_key TEXT NOT NULL,
+                    meal TEXT NOT NULL,
+                    suggestion TEXT NOT NULL,
+                    generated_at REAL NOT NULL,
+                    prompt_version INTEGER NOT NULL,
+                    PRIMARY KEY (profile_key, meal)
+                );
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def record_profile(self, messagesample_data):
+        # Mark the user's current profile as active and return its key
+        profile = profile_from_preferences(messagesample_data)
+        key = profile_key(profile)
+        now = time.time()
+        if now - self._recorded.get(key, 0) < RECORD_INTERVAL:
+            return key
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO profiles (profile_key, profile, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(profile_key) DO UPDATE SET last_seen = excluded.last_seen",
+                (key, json.dumps(profile), now),
+            )
+        self._recorded[key] = now
+        return key
+
+    def get_suggestions(self, key):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT meal, suggestion, generated_at FROM suggestions WHERE profile_key = ?", (key,)
+            ).fetchall()
+        return {meal: {**json.loads(suggestion), "generated_at": generated_at} for meal, suggestion, generated_at in rows}
+
+    def profiles_needing_refresh(self, now=None):
+        # Active profiles that are missing a meal, were generated with an older
+        # prompt, or have gone stale. Everything else is left untouched.
+        now = now or time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT p.profile_key, p.profile
+                FROM profiles p
+                LEFT JOIN suggestions s ON s.profile_key = p.profile_key
+                WHERE p.last_seen >= ?
+                GROUP BY p.profile_key
+                HAVING COUNT(s.meal) < ?
+                    OR MIN(s.prompt_version) < ?
+                    OR MIN(s.generated_at) < ?
+                """,
+                (now - ACTIVE_DAYS * 86400, len(MEALS), PROMPT_VERSION, now - MAX_AGE_DAYS * 86400),
+            ).fetchall()
+        return [(key, json.loads(profile)) for key, profile in rows]
+
+    def save_suggestions(self, key, suggestions):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO suggestions (profile_key, meal, suggestion, generated_at, prompt_version) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, meal, json.dumps(s), now, PROMPT_VERSION) for meal, s in suggestions.items()],
+            )
+
+
+def suggestion_prompt(profile):
+    diets = ", ".join(profile["dietary_preference"]) or "no specific"
+    allergies = ", ".join(profile["allergies"]) or "none"
+    return (
+        f"You are a culinary and nutritional assistant.\n"
+        f"Suggest one {', '.join(MEALS)} for a user with a {diets} diet, "
+        f"allergies: {allergies}, and a daily calorie target of about {profile['calorie_band']} kcal.\n"
+        f"You must respect the dietary preference and allergies.\n"
+        f"Return ONLY a JSON object enclosed in triple backticks, with one key per meal "
+        f"({', '.join(MEALS)}) and each value an object with keys: "
+        f"mname (string), recipe_ingredients (string), calories (int, per serving).\n"
+    )
+
+
+def parse_suggestions(text):
+    json_string = text.strip()
+    if json_string.startswith("```json") and json_string.endswith("```"):
+        json_string = json_string[7:-3].strip()
+    elif json_string.startswith("```") and json_string.endswith("```"):
+        json_string = json_string[3:-3].strip()
+    data = json.loads(json_string)
+
+    suggestions = {}
+    for meal in MEALS:
+        item = data.get(meal)
+        if not isinstance(item, dict) or not item.get("mname"):
+            continue
+        ingredients = item.get("recipe_ingredients", "")
+        if not isinstance(ingredients, str):
+            ingredients = ", ".join(ingredients)
+        try:
+            calories = int(item.get("calories", 0))
+        except (TypeError, ValueError):
+            calories = 0
+        suggestions[meal] = {"mname": item["mname"], "recipe_ingredients": ingredients, "calories": calories}
+    return suggestions
+
+
+def drop_violations(profile, suggestions):
+    # Never store a suggestion the diet guard would reject; the missing meal is
+    # picked up again on the next run.
+    matcher = compile_matcher(forbidden_groups({"user": {"food_preferences": profile}}))
+    kept = {}
+    for meal, item in suggestions.items():
+        guard = DietGuard(matcher)
+        violation = guard.feed(
+            f"Recipe: {item['mname']}\nIngredients:\n{item['recipe_ingredients'].replace(', ', chr(10))}\n"
+        ) or guard.finish()
+        if violation:
+            logger.warning("Dropping %s suggestion '%s': %s", meal, item['mname'], violation)
+            continue
+        kept[meal] = item
+    return kept
+
+
+async def refresh_suggestions(store, llm, max_concurrency=MAX_CONCURRENCY):
+    # Regenerate suggestions for changed profiles only, with at most
+    # max_concurrency LLM calls in flight.
+    pending = store.profiles_needing_refresh()
+    logger.info("Meal suggestions: %s profile(s) need refreshing", len(pending))
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def refresh(key, profile):
+        async with semaphore:
+            try:
+                response = await llm.ainvoke(suggestion_prompt(profile))
+                suggestions = drop_violations(profile, parse_suggestions(response.content))
+            except Exception as e:
+                logger.error("Error generating suggestions for profile %s: %s", key, e)
+                return False
+        store.save_suggestions(key, suggestions)
+        return len(suggestions) == len(MEALS)
+
+    results = await asyncio.gather(*(refresh(key, profile) for key, profile in pending))
+    refreshed = sum(results)
+    logger.info("Meal suggestions: refreshed %s/%s profile(s)", refreshed, len(pending))
+    return refreshed
+
+
+# Run the batch job, e.g. from cron: python meal_suggestions.py
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in .env")
+
+    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=api_key, temperature=0.7)
+    asyncio.run(refresh_suggestions(SuggestionStore(), llm))
@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# End-to-end budget for one incoming request, shared by every stage it calls
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+# Cap for a single call to the Express server
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "5"))
+# Never hedge sooner than this, even if p95 is tiny
+MIN_HEDGE_DELAY = 0.05
+# Task.cancel() message for calls cut off by the deadline. CircuitBreaker.acall
+# counts these as failures; any other cancellation (a hedge that lost, a client
+# that went away) says nothing about upstream health.
+DEADLINE_CANCEL = "deadline exceeded"
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds=REQUEST_TIMEOUT):
+    # Set an absolute deadline for everything called within this block. A
+    # nested deadline can only shorten the outer one.
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(min(at, outer) if outer else at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(cap=None):
+    # Seconds left before the current deadline, optionally capped.
+    at = _deadline.get()
+    left = at - time.monotonic() if at else None
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    if cap is None:
+        return left
+    return cap if left is None else min(cap, left)
+
+
+class LatencyTracker:
+    # Rolling window of successful call latencies, used to pick hedge delays.
+
+    def __init__(self, window=200, default=2.0):
+        self.samples = deque(maxlen=window)
+        self.default = default
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if len(self.samples) < 20:
+            return self.default
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and rejects calls
+    # until `reset_timeout` has passed, then lets a single trial call through.
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self._trial_in_flight):
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            if state == "half-open":
+                self._trial_in_flight = True
+
+    def on_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("%s circuit closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("%s circuit opened after %s failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.on_failure()
+            raise
+        self.on_success()
+        return result
+
+    async def acall(self, factory):
+        self.before_call()
+        try:
+            result = await factory()
+        except asyncio.CancelledError as e:
+            if e.args and e.args[0] == DEADLINE_CANCEL:
+                self.on_failure()
+            else:
+                with self._lock:
+                    self._trial_in_flight = False
+            raise
+        except Exception:
+            self.on_failure()
+            raise
+        self.on_success()
+        return result
+
+    def as_dict(self):
+        return {"state": self.state, "failures": self.failures}
+
+
+express_breaker = CircuitBreaker("express")
+gemini_breaker = CircuitBreaker("gemini")
+
+
+def call_backend(method, url, **kwargs):
+    # requests call to the Express server with a timeout taken from the current
+    # deadline; 5xx responses count as failures for the breaker.
+    timeout = remaining(BACKEND_TIMEOUT)
+
+    def send():
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"{response.status_code} from {url}", response=response)
+        return response
+
+    try:
+        return express_breaker.call(send)
+    except requests.Timeout as e:
+        raise DeadlineExceeded(f"Timed out calling {url}") from e
+
+
+async def bounded(factory, breaker=gemini_breaker):
+    # breaker.acall(factory), bounded by the current deadline. Unlike
+    # asyncio.wait_for, running out of time counts as a breaker failure.
+    task = asyncio.ensure_future(breaker.acall(factory))
+    reason = None
+    try:
+        done, _ = await asyncio.wait([task], timeout=remaining())
+        if not done:
+            reason = DEADLINE_CANCEL
+            raise DeadlineExceeded("Request deadline exceeded")
+        return task.result()
+    finally:
+        task.cancel(reason)
+
+
+async def hedged(factory, tracker, breaker=gemini_breaker, max_attempts=2):
+    # Run factory(); if it has not finished after the tracked p95 latency,
+    # start a duplicate and return whichever succeeds first. Losers are
+    # cancelled. The whole thing is bounded by the current deadline.
+    budget = remaining()
+    started = time.monotonic()
+    delay = max(MIN_HEDGE_DELAY, tracker.percentile(0.95))
+    tasks = [asyncio.ensure_future(breaker.acall(factory))]
+    launched = 1
+    reason = None
+    try:
+        while True:
+            timeout = delay if launched < max_attempts else None
+            if budget is not None:
+                left = budget - (time.monotonic() - started)
+                if left <= 0:
+                    reason = DEADLINE_CANCEL
+                    raise DeadlineExceeded("Request deadline exceeded")
+                timeout = left if timeout is None else min(timeout, left)
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                if launched >= max_attempts:
+                    reason = DEADLINE_CANCEL
+                    raise DeadlineExceeded("Request deadline exceeded")
+                logger.info("Hedging after %.2fs", delay)
+                tasks.append(asyncio.ensure_future(breaker.acall(factory)))
+                launched += 1
+                continue
+
+            error = None
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    tracker.record(time.monotonic() - started)
+                    return task.result()
+                error = task.exception()
+            if tasks:
+                # Another attempt is still running, e.g. a half-open breaker
+                # rejected the hedge while the trial call is in flight
+                continue
+            if isinstance(error, CircuitOpenError) or launched >= max_attempts:
+                raise error
+            # First attempt failed outright: retry without waiting
+            tasks.append(asyncio.ensure_future(breaker.acall(factory)))
+            launched += 1
+    finally:
+        for task in tasks:
+            task.cancel(reason)
+
+
+class ResponseCache:
+    # Small LRU of successful answers, served when an upstream is unhealthy.
+    # Shared between the event loop and worker threads.
+
+    def __init__(self, size=256):
+        self.size = size
+        self.items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
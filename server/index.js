@@ -337,6 +337,37 @@ app.put('/dietary-preferences', async (req, res) => {
 
 //Connsumed meals
 
+// Push a meal log (or, with sign -1, its removal) to the analytics rollups in the
+// Python middleware. Fire-and-forget: the dashboard must not wait on analytics.
+// Requests are signed with ANALYTICS_SECRET, which must match the middleware's.
+const ANALYTICS_URL = process.env.ANALYTICS_URL || "http://localhost:8000/analytics/meal-logged";
+const ANALYTICS_SECRET = process.env.ANALYTICS_SECRET;
+async function notifyAnalytics(userid, mid, date, sign = 1) {
+    if (!ANALYTICS_SECRET) {
+        // Rollups are reloaded from /meal-history instead
+        return;
+    }
+    try {
+        const meal = await pool.query("SELECT calories FROM user_recipe_table WHERE mid = $1", [mid]);
+        const goal = await pool.query("SELECT daily_calorie_goal FROM user_dietary_preference WHERE userid = $1", [userid]);
+        const response = await fetch(ANALYTICS_URL, {
+            method: "POST",
+            headers: { "Content-Type": "application/json", "X-Analytics-Secret": ANALYTICS_SECRET },
+            body: JSON.stringify({
+                userid,
+                date: date instanceof Date ? date.toLocaleDateString("en-CA") : date,
+                calories: sign * (meal.rows[0]?.calories || 0),
+                calorie_goal: goal.rows[0]?.daily_calorie_goal || null,
+            }),
+        });
+        if (!response.ok) {
+            console.error("Failed to update analytics:", response.status, await response.text());
+        }
+    } catch (err) {
+        console.error("Failed to update analytics:", err.message);
+    }
+}
+
 // Create consumed meal
 app.post('/consumed-meals', async (req, res) => {
     const sessionid = req.cookies.sessionid;
@@ -361,6 +392,7 @@ app.post('/consumed-meals', async (req, res) => {
             "INSERT INTO consumed_meals (mid, userid, day, date) VALUES ($1, $2, $3, $4) RETURNING *",
             [mid, user.rows[0].userid, day, date]
         );
+        notifyAnalytics(user.rows[0].userid, mid, date);
         res.status(201).json(result.rows[0]);
     } catch (err) {
         console.error(err.message);
@@ -407,6 +439,7 @@ app.delete('/consumed-meals/:id', async (req, res) => {
         if (result.rows.length === 0) {
             return res.status(404).json({ message: "Consumed meal not found" });
         }
+        notifyAnalytics(user.rows[0].userid, result.rows[0].mid, result.rows[0].date, -1);
         res.json({ message: "Consumed meal deleted successfully" });
     } catch (err) {
         console.error(err.message);
@@ -429,13 +462,20 @@ app.put('/consumed-meals/:id', async (req, res) => {
     const { id } = req.params;
     const { mid, day, date } = req.body;
     try {
+        const old = await pool.query("SELECT mid, date FROM consumed_meals WHERE cmid = $1 AND userid = $2", [id, user.rows[0].userid]);
+        if (old.rows.length === 0) {
+            return res.status(404).json({ message: "Consumed meal not found" });
+        }
         const result = await pool.query(
-            "UPDATE consumed_meals SET mid = $1, day = $2, date = $3 WHERE id = $4 AND userid = $5 RETURNING *",
+            "UPDATE consumed_meals SET mid = $1, day = $2, date = $3 WHERE cmid = $4 AND userid = $5 RETURNING *",
             [mid, day, date, id, user.rows[0].userid]
         );
         if (result.rows.length === 0) {
             return res.status(404).json({ message: "Consumed meal not found" });
         }
+        // Move the calories from the old meal/date to the new one
+        notifyAnalytics(user.rows[0].userid, old.rows[0].mid, old.rows[0].date, -1)
+            .then(() => notifyAnalytics(user.rows[0].userid, result.rows[0].mid, result.rows[0].date));
         res.json(result.rows[0]);
     } catch (err) {
         console.error(err.message);
@@ -443,6 +483,45 @@ app.put('/consumed-meals/:id', async (req, res) => {
     }
 });
 
+// Full meal history for the analytics rollups in the Python middleware
+app.get('/meal-history', async (req, res) => {
+    const sessionid = req.cookies.sessionid;
+    if (!sessionid) {
+        return res.status(401).json({ message: "Unauthorized" });
+    }
+    // Get useremail from sessionid
+    const user = await pool.query("SELECT userid FROM user_login_table WHERE sessionid = $1", [sessionid]);
+    if (user.rows.length === 0) {
+        return res.status(404).json({ message: "invalid session id" });
+    }
+
+    try {
+        const goal = await pool.query("SELECT daily_calorie_goal FROM user_dietary_preference WHERE userid = $1", [user.rows[0].userid]);
+        // ?meals=0 only identifies the user
+        if (req.query.meals === "0") {
+            return res.json({ userid: user.rows[0].userid, calorie_goal: goal.rows[0]?.daily_calorie_goal || null });
+        }
+        const meals = await pool.query(
+            `SELECT cm.date::date AS date, urt.calories
+            FROM consumed_meals cm
+            JOIN user_recipe_table urt ON cm.mid = urt.mid
+            WHERE cm.userid = $1 AND cm.userid = urt.userid`,
+            [user.rows[0].userid]
+        );
+        res.json({
+            userid: user.rows[0].userid,
+            calorie_goal: goal.rows[0]?.daily_calorie_goal || null,
+            meals: meals.rows.map(row => ({
+                date: row.date instanceof Date ? row.date.toLocaleDateString("en-CA") : row.date,
+                calories: row.calories,
+            })),
+        });
+    } catch (err) {
+        console.error(err.message);
+        res.status(500).send("Server Error");
+    }
+});
+
 // Create saved user meals
 app.post('/saved-meals/:id', async (req, res) => {
     const sessionid = req.cookies.sessionid;